@@ -1,45 +1,56 @@
 import os
 import json
+import base64
+import time
 import cv2
 import math
+import numpy as np
 import tkinter as tk
 from tkinter import ttk, scrolledtext, filedialog
-from PIL import Image, ImageTk
 import threading
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import ollama
 
+from jsonlog import parse_json
+
 # ----------------------------
 # CONFIG
 # ----------------------------
 LLM_MODEL = "phi3:latest"
+LLM_KEEP_ALIVE = "30m"  # keep the model (and its prompt cache) loaded between questions
 LOG_PATH = "insect_log2.json"
-DEFAULT_VIDEO = "/home/aaswat/insects/insect_detection_output.avi"
+DEFAULT_VIDEO = "/home/aaswat/insects/insect_detection_output.mkv"
+if not os.path.exists(DEFAULT_VIDEO):  # XVID fallback from insect.py
+    DEFAULT_VIDEO = os.path.splitext(DEFAULT_VIDEO)[0] + ".avi"
 
 insect_colors = {"Mosquito": "#e74c3c", "Fly": "#2ecc71", "Cockroach": "#f1c40f"}
 
 # ----------------------------
 # Utilities
 # ----------------------------
-def ask_phi3_short(prompt: str) -> str:
+def stream_phi3_short(prompt: str, context: str = ""):
+    """Yield answer tokens as they are generated"""
     try:
+        # Context lives in the system message so the prefix is identical across questions (prompt cache)
+        system = "You are an insect analysis assistant. Keep answers simple, accurate, and provide advice in [brackets]."
+        if context:
+            system += "\n\n" + context
         messages = [
-            {"role": "system",
-             "content": "You are an insect analysis assistant. Keep answers simple, accurate, and provide advice in [brackets]."},
+            {"role": "system", "content": system},
             {"role": "user", "content": prompt}
         ]
-        res = ollama.chat(model=LLM_MODEL, messages=messages)
-        return res["message"]["content"].strip()
+        for chunk in ollama.chat(model=LLM_MODEL, messages=messages, stream=True, keep_alive=LLM_KEEP_ALIVE):
+            yield chunk["message"]["content"]
     except Exception as e:
-        return f"[Ollama error: {e}]"
+        yield f"[Ollama error: {e}]"
 
 def load_sessions():
     if not os.path.exists(LOG_PATH):
         return []
     try:
-        with open(LOG_PATH, "r") as f:
-            raw = json.load(f)
+        with open(LOG_PATH, "rb") as f:
+            raw = parse_json(f.read())
         # Convert each timestamp key into a session dict
         sessions = []
         for ts, data in raw.items():
@@ -69,6 +80,13 @@ def compute_angles_and_distances(raw_detections, video_path):
         }
     return out
 
+def normalize_angles_rad(angles_deg):
+    """Map angles in degrees to the radar's -90°..90° range, in radians"""
+    a = np.asarray(angles_deg, dtype=float) % 360
+    a = np.where(a > 180, a - 360, a)
+    a = np.where(a > 90, a - 180, a)  # shift to -90 → 90 range
+    return np.deg2rad(a)
+
 # ----------------------------
 # Main UI
 # ----------------------------
@@ -82,6 +100,14 @@ class InsectPopup(tk.Toplevel):
         self.current_session = sessions[-1] if sessions else {}
         self.video_cap = None
         self.video_running = False
+        self.video_lock = threading.Lock()  # guards latest_frame/latest_pos and seek_request only
+        self.reader_thread = None
+        self.latest_frame = None
+        self.latest_pos = 0
+        self.seek_request = None  # frame index for the reader thread to seek to
+        self.slider_pos = 0  # last value display_latest put on the slider
+        self.target_size = (900, 450)
+        self.display_job = None
 
         style = ttk.Style(self)
         style.theme_use("clam")
@@ -99,6 +125,9 @@ class InsectPopup(tk.Toplevel):
             self.current_session,
             self.current_session.get("video_reference", DEFAULT_VIDEO)
         )
+        # Sessions don't change while the popup is open, so summarize them once
+        self.overall_summary = self.compute_overall_summary()
+        self.overall_summary_json = json.dumps(self.overall_summary,indent=2)
 
         self.build_tab1()
         self.build_tab2()
@@ -161,36 +190,74 @@ class InsectPopup(tk.Toplevel):
         self.video_running = True
         self.total_frames = int(self.video_cap.get(cv2.CAP_PROP_FRAME_COUNT))
         self.slider.config(to=self.total_frames-1)
-        self.update_video_frame()
-
-    def update_video_frame(self):
-        if self.video_cap and self.video_running:
-            ret, frame = self.video_cap.read()
-            if ret:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                w,h = self.video_label.winfo_width(), self.video_label.winfo_height()
-                frame = cv2.resize(frame,(w,h))
-                img = Image.fromarray(frame)
-                imgtk = ImageTk.PhotoImage(image=img)
-                self.video_label.imgtk = imgtk
-                self.video_label.config(image=imgtk)
-                self.slider.set(int(self.video_cap.get(cv2.CAP_PROP_POS_FRAMES)))
-                self.after(30,self.update_video_frame)
-            else:
-                self.video_cap.set(cv2.CAP_PROP_POS_FRAMES,0)
+        self.reader_thread = threading.Thread(target=self.reader_loop, args=(self.video_cap,), daemon=True)
+        self.reader_thread.start()
+        self.display_latest()
+
+    def reader_loop(self, cap):
+        """Decode, convert and resize frames off the Tk thread; this thread owns `cap`"""
+        delay = 1.0 / (cap.get(cv2.CAP_PROP_FPS) or 30)
+        while self.video_cap is cap:
+            with self.video_lock:
+                seek, self.seek_request = self.seek_request, None
+            if seek is not None:
+                cap.set(cv2.CAP_PROP_POS_FRAMES,seek)
+            if not self.video_running:
+                time.sleep(0.05); continue
+            t0 = time.time()
+            ret, frame = cap.read()
+            pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+            if not ret:
+                cap.set(cv2.CAP_PROP_POS_FRAMES,0)
                 self.video_running = False
-
-    def play_video(self): self.video_running=True; self.update_video_frame()
+                continue
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            frame = cv2.resize(frame, self.target_size)
+            # Binary PPM (header + raw RGB) is decoded by Tk itself, no PIL round-trip
+            h, w = frame.shape[:2]
+            ppm = base64.b64encode(f"P6 {w} {h} 255 ".encode() + frame.tobytes())
+            with self.video_lock:
+                self.latest_frame, self.latest_pos = ppm, pos
+            time.sleep(max(0.0, delay - (time.time() - t0)))
+        cap.release()
+
+    def display_latest(self):
+        """Push the newest decoded frame to the label"""
+        if not self.video_cap: return
+        with self.video_lock:
+            ppm, self.latest_frame = self.latest_frame, None
+            pos = self.latest_pos
+        if ppm is not None:
+            imgtk = tk.PhotoImage(data=ppm, format="PPM")
+            self.video_label.imgtk = imgtk
+            self.video_label.config(image=imgtk)
+            self.slider_pos = pos
+            self.slider.set(pos)
+        self.target_size = (self.video_label.winfo_width(), self.video_label.winfo_height())
+        self.display_job = self.after(15, self.display_latest)
+
+    def play_video(self): self.video_running=True
     def pause_video(self): self.video_running=False
     def seek_video(self,val):
-        if self.video_cap:
-            self.video_cap.set(cv2.CAP_PROP_POS_FRAMES,int(val))
+        # slider.set() from display_latest calls back here; only seek on user moves
+        if self.video_cap and int(val) != self.slider_pos:
+            self.slider_pos = int(val)
+            with self.video_lock:
+                self.seek_request = int(val)
     def open_video(self):
         path = filedialog.askopenfilename(filetypes=[("Video files","*.mp4 *.avi *.mov *.mkv")])
         if path: self.start_video(path)
     def release_video(self):
         self.video_running=False
-        if self.video_cap: self.video_cap.release(); self.video_cap=None
+        if self.display_job: self.after_cancel(self.display_job); self.display_job=None
+        cap, self.video_cap = self.video_cap, None
+        with self.video_lock:
+            self.latest_frame, self.latest_pos, self.seek_request = None, 0, None
+        self.slider_pos = 0
+        if self.reader_thread:
+            # The reader releases its capture when it notices video_cap changed
+            self.reader_thread.join(timeout=1.0); self.reader_thread=None
+        elif cap: cap.release()
 
     # ----------------------------
     # TAB 2 - Radar & Pie
@@ -199,21 +266,25 @@ class InsectPopup(tk.Toplevel):
         frame = tk.Frame(self.tab2,bg="#f0f2f5"); frame.pack(fill=tk.BOTH,expand=True,padx=15,pady=15)
         ttk.Button(frame,text="Update Radar/Pie",command=self.plot_graph).pack(pady=5)
         self.canvas_frame = tk.Frame(frame,bg="#ffffff",relief="solid",bd=1); self.canvas_frame.pack(fill=tk.BOTH,expand=True,pady=10)
+
+        # Figure and canvas are built once; plot_graph only redraws the axes
+        self.fig = plt.Figure(figsize=(16,6))
+        self.ax1 = self.fig.add_subplot(121, polar=True)
+        self.ax2 = self.fig.add_subplot(122)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.canvas_frame)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH,expand=True)
         self.plot_graph()
 
     def plot_graph(self):
-        for w in self.canvas_frame.winfo_children(): 
-            w.destroy()
+        ax1, ax2 = self.ax1, self.ax2
+        ax1.cla(); ax2.cla()
 
         # --- Pie Data ---
         per_label = {k:v.get("count",0) for k,v in self.current_session.items() if isinstance(v,dict) and k!="nearest"}
         labels, counts = list(per_label.keys()), list(per_label.values())
         if not labels: labels=["None"]; counts=[0]
 
-        fig = plt.Figure(figsize=(16,6))
-
         # --- Radar Chart (180° FOV, 0° center, max 1.5 m) ---
-        ax1 = fig.add_subplot(121, polar=True)
         ax1.set_theta_zero_location("N")
         ax1.set_theta_direction(-1)  # clockwise
         ax1.set_thetalim(math.radians(-90), math.radians(90))  # left=-90°, right=90°
@@ -224,22 +295,17 @@ class InsectPopup(tk.Toplevel):
         ax1.set_rticks(distance_rings)
         ax1.grid(True, linestyle='--', linewidth=0.7)
 
-        for label,pos in self.positions_info.items():
+        # Normalize all angles in one pass: convert 0-180° → -90° to 90°
+        pos_labels = list(self.positions_info.keys())
+        pos_values = list(self.positions_info.values())
+        entry_rads = normalize_angles_rad([p["entry_angle_deg"] for p in pos_values])
+        exit_rads = normalize_angles_rad([p["exit_angle_deg"] for p in pos_values])
+
+        for label,pos,entry_rad,exit_rad in zip(pos_labels,pos_values,entry_rads,exit_rads):
             color = insect_colors.get(label,"blue")
-            entry_deg = pos["entry_angle_deg"]
-            exit_deg = pos["exit_angle_deg"]
             entry_dist = pos["entry_dist_m"]
             exit_dist = pos["exit_dist_m"]
 
-            # Normalize angles: convert 0-180° → -90° to 90°
-            def normalize_angle(a):
-                a = a % 360
-                if a > 180: a -= 360
-                return a - 180 if a > 90 else a  # shift to -90 → 90 range
-
-            entry_rad = math.radians(normalize_angle(entry_deg))
-            exit_rad = math.radians(normalize_angle(exit_deg))
-
             # Draw line between entry → exit
             ax1.plot([entry_rad, exit_rad], [entry_dist, exit_dist], color=color, lw=2)
 
@@ -253,14 +319,11 @@ class InsectPopup(tk.Toplevel):
         ax1.set_title("180° Radar (0° center, max 1.5 m)")
 
         # --- Pie Chart ---
-        ax2 = fig.add_subplot(122)
         ax2.pie(counts, labels=labels, autopct=lambda p:f'{p:.1f}%' if p>0 else '',
                 colors=[insect_colors.get(l,"gray") for l in labels])
         ax2.set_title("Insect Proportion")
 
-        canvas = FigureCanvasTkAgg(fig, master=self.canvas_frame)
-        canvas.draw()
-        canvas.get_tk_widget().pack(fill=tk.BOTH,expand=True)
+        self.canvas.draw_idle()
 
     # ---------------- TAB 3 ----------------
     def build_tab3(self):
@@ -281,36 +344,46 @@ class InsectPopup(tk.Toplevel):
         self.advice_box.insert(tk.END,f"\n\n🧑 You: {prompt}\n")
 
         def run_llm():
-            # --- Build compact overall summary ---
-            overall_summary = {}
-            for sess in self.sessions:
-                for label,info in sess.items():
-                    if not isinstance(info,dict) or label in ("session_info","video_reference","nearest"):
-                        continue
-                    if label not in overall_summary:
-                        overall_summary[label] = {"count":0,"angles":[],"distances":[]}
-                    overall_summary[label]["count"] += info.get("count",0)
-                    if "start_angle_deg" in info: overall_summary[label]["angles"].append(info["start_angle_deg"])
-                    if "end_angle_deg" in info: overall_summary[label]["angles"].append(info["end_angle_deg"])
-                    if "start_distance_m" in info: overall_summary[label]["distances"].append(info["start_distance_m"])
-                    if "end_distance_m" in info: overall_summary[label]["distances"].append(info["end_distance_m"])
-
             ctx = (
                 "You are analyzing insect detection logs.\n\n"
                 f"Current session data:\n{json.dumps(self.current_session,indent=2)}\n\n"
-                f"Overall summary of all sessions:\n{json.dumps(overall_summary,indent=2)}\n\n"
+                f"Overall summary of all sessions:\n{self.overall_summary_json}\n\n"
                 "When the user asks:\n"
                 "- If question is about 'this session' → use Current session.\n"
-                "- If question is about 'overall', 'most', 'total', 'all data', or comparisons → use Overall summary.\n\n"
-                f"User Question: {prompt}\nAnswer clearly:"
+                "- If question is about 'overall', 'most', 'total', 'all data', or comparisons → use Overall summary."
             )
 
-            answer = ask_phi3_short(ctx)
-            self.advice_box.insert(tk.END,f"🤖 AI: {answer}\n")
-            self.advice_box.see(tk.END)
+            self.after(0, self.append_advice, "🤖 AI: ")
+            started = False
+            for tok in stream_phi3_short(f"User Question: {prompt}\nAnswer clearly:", ctx):
+                if not started:
+                    tok = tok.lstrip()
+                    started = bool(tok)
+                if tok: self.after(0, self.append_advice, tok)
+            self.after(0, self.append_advice, "\n")
 
         threading.Thread(target=run_llm,daemon=True).start()
 
+    def compute_overall_summary(self):
+        """Compact per-label summary across all sessions"""
+        overall_summary = {}
+        for sess in self.sessions:
+            for label,info in sess.items():
+                if not isinstance(info,dict) or label in ("session_info","video_reference","nearest"):
+                    continue
+                if label not in overall_summary:
+                    overall_summary[label] = {"count":0,"angles":[],"distances":[]}
+                overall_summary[label]["count"] += info.get("count",0)
+                if "start_angle_deg" in info: overall_summary[label]["angles"].append(info["start_angle_deg"])
+                if "end_angle_deg" in info: overall_summary[label]["angles"].append(info["end_angle_deg"])
+                if "start_distance_m" in info: overall_summary[label]["distances"].append(info["start_distance_m"])
+                if "end_distance_m" in info: overall_summary[label]["distances"].append(info["end_distance_m"])
+        return overall_summary
+
+    def append_advice(self, text):
+        self.advice_box.insert(tk.END, text)
+        self.advice_box.see(tk.END)
+
     # ---------------- General ----------------
     def change_session(self,event=None):
         key = self.session_var.get()
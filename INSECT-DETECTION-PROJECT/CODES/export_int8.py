@@ -0,0 +1,49 @@
+import os
+import time
+import cv2
+from ultralytics import YOLO
+from picamera2 import Picamera2
+
+# ==========================
+# CONFIG
+# ==========================
+# One-time offline INT8 export for insect.py (USE_INT8). Run once on the Pi, with
+# the camera pointed at the monitored scene:  python export_int8.py
+INFER_RES = 640
+MODEL_PATHS = ["cockroach-n.pt", "100best.pt"]
+CALIB_DATA = "calib.yaml"  # images-only dataset used to calibrate the INT8 export
+CALIB_DIR = "calib/images"
+CALIB_IMAGES = 200
+
+# ==========================
+# FUNCTIONS
+# ==========================
+def collect_calibration_images():
+    """Fill CALIB_DIR with frames from this camera, so INT8 ranges match the deployment scene"""
+    os.makedirs(CALIB_DIR, exist_ok=True)
+    have = len([f for f in os.listdir(CALIB_DIR) if f.endswith(".jpg")])
+    if have >= CALIB_IMAGES:
+        return
+    print(f"Capturing {CALIB_IMAGES - have} INT8 calibration frames into {CALIB_DIR}...")
+    picam2 = Picamera2()
+    cfg = picam2.create_video_configuration(lores={"size": (INFER_RES, INFER_RES), "format": "YUV420"})
+    picam2.configure(cfg)
+    picam2.start()
+    time.sleep(0.1)
+    try:
+        for k in range(have, CALIB_IMAGES):
+            frame = cv2.cvtColor(picam2.capture_array("lores"), cv2.COLOR_YUV420p2BGR)
+            cv2.imwrite(os.path.join(CALIB_DIR, f"calib_{k:04d}.jpg"), frame)
+            time.sleep(0.05)
+    finally:
+        picam2.stop()
+
+def export_int8(model_path):
+    """Export <stem>_saved_model/<stem>_int8.tflite, which insect.py loads when USE_INT8 is set"""
+    path = YOLO(model_path).export(format="tflite", int8=True, data=CALIB_DATA, imgsz=INFER_RES)
+    print(f"{model_path} -> {path}")
+
+if __name__ == "__main__":
+    collect_calibration_images()
+    for model_path in MODEL_PATHS:
+        export_int8(model_path)
@@ -1,14 +1,24 @@
 import time
 import cv2
 import numpy as np
+import torch
 from ultralytics import YOLO
 from picamera2 import Picamera2
 import math
-from collections import deque
+import queue
+import threading
 import oledandled
 import os
-import json
 from datetime import datetime
+from jsonlog import parse_json, dump_json
+
+try:
+    from numba import njit
+except ImportError:
+    print("⚠️ numba not found, detection math runs uncompiled.")
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]): return args[0]
+        return lambda f: f
 
 # ==========================
 # CONFIG
@@ -18,8 +28,12 @@ INFER_RES = 640
 HIGH_RES = (2304,1296)
 CONF_THRESH = 0.25
 MIN_BOX_SIZE = 10
+BATCH = 4  # frames per YOLO forward pass
+DETECT_EVERY = 2  # run YOLO on every Nth frame, predict boxes on the frames in between
 
 CLASS_LABELS = {2: "fly", 3: "Cockroach"}
+SPECIES = list(CLASS_LABELS.values())
+SPECIES_INDEX = {label: i for i, label in enumerate(SPECIES)}
 REAL_WIDTHS_M = {"fly": 0.08, "Cockroach": 0.08}
 FOCAL_LENGTH_PIXELS = 1200.0
 
@@ -33,44 +47,112 @@ MAX_TRAIL = 30
 # Models
 MODEL_PATH_1 = "cockroach-n.pt"
 MODEL_PATH_2 = "100best.pt"
-models = [YOLO(MODEL_PATH_1), YOLO(MODEL_PATH_2)]
+USE_INT8 = True  # load the INT8 TFLite exports made offline by export_int8.py, if present
+
+def load_model(model_path):
+    """Load a YOLO model, using its INT8 TFLite export when USE_INT8 is set and it exists"""
+    if USE_INT8:
+        stem = os.path.splitext(model_path)[0]
+        int8_path = os.path.join(f"{stem}_saved_model", f"{os.path.basename(stem)}_int8.tflite")
+        if os.path.exists(int8_path):
+            return YOLO(int8_path, task="detect")
+        print(f"⚠️ No INT8 export at {int8_path} (run export_int8.py), using FP32.")
+    return YOLO(model_path)
+
+models = [load_model(MODEL_PATH_1), load_model(MODEL_PATH_2)]
+# Exported backends (TFLite) run one image per call, so only batch when every model is PyTorch
+if not all(isinstance(model.model, torch.nn.Module) for model in models):
+    BATCH = 1
 
 # Camera setup
 picam2 = Picamera2()
-cfg = picam2.create_video_configuration(main={"size": HIGH_RES, "format": "RGB888"})
+# lores stream is scaled to the inference size by the ISP, so the CPU never resizes.
+# YUV420 is the only lores format Pi 4 and earlier accept; it is converted with one cheap cvtColor.
+cfg = picam2.create_video_configuration(main={"size": HIGH_RES, "format": "RGB888"},
+                                        lores={"size": (INFER_RES, INFER_RES), "format": "YUV420"})
 picam2.configure(cfg)
 picam2.start()
 time.sleep(0.1)
 
+# Capture thread -> main loop
+frame_queue = queue.Queue(maxsize=2)
+capture_running = threading.Event()
+capture_running.set()
+
 # Memory
 prev_centers = {}
-trajectories = {}
+trajectories = {}  # label -> (MAX_TRAIL, 2) int32 ring buffer of radar points
+traj_heads = {}  # label -> total points written (next slot is head % MAX_TRAIL)
 prev_time = 0
 speed_tracker = {}
-species_summary = {}  # Track overall summary per species
-nearest_encounter = {"distance_m": float('inf'), "frame": None, "label": None, "angle_deg": None}
+detected_centers = {}  # label -> (cx, cy, capture time) at the last YOLO frame
+track_velocity = {}  # label -> (vx, vy) px per second, for off-frame prediction
+# Species summary, struct-of-arrays with one slot per SPECIES entry
+species_seen = np.zeros(len(SPECIES), dtype=bool)
+species_count = np.zeros(len(SPECIES), dtype=np.int64)
+species_entry_angle = np.zeros(len(SPECIES))
+species_exit_angle = np.zeros(len(SPECIES))
+species_entry_dist = np.zeros(len(SPECIES))
+species_exit_dist = np.zeros(len(SPECIES))
+nearest_encounter = {"distance_m": None, "frame": None, "label": None, "angle_deg": None}  # None until first detection
 
 # Video output
 VIDEO_FPS = 30
 frame_interval = 1.0 / VIDEO_FPS
-output_filename = "insect_detection_output.avi"
-fourcc = cv2.VideoWriter_fourcc(*'XVID')
+USE_HW_ENCODER = True  # H.264 via V4L2 M2M (GStreamer) in Matroska, falls back to XVID
 frame_width = LOW_RES[0]
 frame_height = LOW_RES[1] + RADAR_SIZE
-out = cv2.VideoWriter(output_filename, fourcc, VIDEO_FPS, (frame_width, frame_height))
+out = None
+if USE_HW_ENCODER:
+    # Matroska stays playable up to the last written frame, so a power cut or kill
+    # does not lose the recording (mp4mux only writes its index on EOS)
+    output_filename = "insect_detection_output.mkv"
+    gst_pipeline = ("appsrc ! videoconvert ! video/x-raw,format=I420 ! v4l2h264enc ! "
+                    "video/x-h264,level=(string)4 ! h264parse ! matroskamux ! "
+                    f"filesink location={output_filename}")
+    out = cv2.VideoWriter(gst_pipeline, cv2.CAP_GSTREAMER, 0, VIDEO_FPS, (frame_width, frame_height))
+    if not out.isOpened():
+        print("⚠️ Hardware H.264 encoder unavailable, using XVID.")
+        out = None
+if out is None:
+    output_filename = "insect_detection_output.avi"
+    fourcc = cv2.VideoWriter_fourcc(*'XVID')
+    out = cv2.VideoWriter(output_filename, fourcc, VIDEO_FPS, (frame_width, frame_height))
+
+# Display buffers, allocated once and reused every frame
+final_display = np.empty((frame_height, frame_width, 3), dtype=np.uint8)
+radar1 = np.empty((RADAR_SIZE, RADAR_SIZE, 3), dtype=np.uint8)
+radar2 = np.empty((RADAR_SIZE, RADAR_SIZE, 3), dtype=np.uint8)
+radar_combined = np.empty((RADAR_SIZE, 2*RADAR_SIZE, 3), dtype=np.uint8)
 
 # JSON logging
 json_filename = "insect_log2.json"
+
+json_data = {}
 if os.path.exists(json_filename):
     try:
-        with open(json_filename, "r") as f:
-            json_data = json.load(f)
+        with open(json_filename, "rb") as f:
+            json_data = parse_json(f.read())
         if not isinstance(json_data, dict):
-            json_data = {}
-    except Exception:
+            raise ValueError("log is not a JSON object")
+        # Older runs stored an unset nearest distance as Infinity, which is not valid JSON
+        nearest = json_data.get("nearest_encounter")
+        if isinstance(nearest, dict) and isinstance(nearest.get("distance_m"), float) \
+                and not math.isfinite(nearest["distance_m"]):
+            nearest["distance_m"] = None
+    except Exception as e:
+        # Never overwrite a log we could not read: move it aside and start a new one
+        bad_filename = f"{json_filename}.unreadable-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        print(f"JSON load error, moving {json_filename} to {bad_filename}:", e)
+        try:
+            os.replace(json_filename, bad_filename)
+        except OSError as move_error:
+            # Could not move it either: leave it untouched and log this run to a new file
+            json_filename = f"insect_log2-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+            print(f"Could not move log ({move_error}), logging to {json_filename}")
         json_data = {}
-else:
-    json_data = {}
+
+json_queue = queue.Queue()
 
 frame_id = 0
 
@@ -78,237 +160,353 @@ frame_id = 0
 # FUNCTIONS
 # ==========================
 def save_json():
-    """Save JSON file safely"""
+    """Save JSON file safely (temp file + atomic rename)"""
+    tmp_filename = json_filename + ".tmp"
     try:
-        with open(json_filename, "w") as f:
-            json.dump(json_data, f, indent=4)
+        with open(tmp_filename, "wb") as f:
+            f.write(dump_json(json_data))
+        os.replace(tmp_filename, json_filename)
     except Exception as e:
         print("JSON save error:", e)
 
+def json_writer_loop():
+    """Merge queued (key, entry) snapshots into json_data and save them off the main loop"""
+    stop = False
+    while not stop:
+        items = [json_queue.get()]
+        while True:
+            try:
+                items.append(json_queue.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in items
+        updates = [item for item in items if item is not None]
+        for key, entry in updates:
+            json_data[key] = entry
+        if updates:
+            save_json()
+
+@njit(cache=True, fastmath=True)
 def get_distance_meters(width_px: float, real_width_m: float, focal_px: float) -> float:
     if width_px <= 0 or focal_px <= 0 or real_width_m <= 0:
         return 0.0
     return (real_width_m * focal_px) / width_px
 
-def draw_radar_points(radar_data, radar_size):
-    radar = np.zeros((radar_size, radar_size, 3), dtype=np.uint8)
-    cx, cy = radar_size // 2, radar_size // 2
-    max_r = radar_size // 2 - 20
-    for r_m in RADAR_CIRCLES:
-        r_px = int((r_m / RADAR_RANGE_M) * max_r)
-        cv2.circle(radar, (cx, cy), r_px, (30, 80, 30), 1)
-        cv2.putText(radar, f"{r_m:.1f}m", (cx+5, cy-r_px+10),
+@njit(cache=True, fastmath=True)
+def compute_detection_stats(boxes, real_widths, focal_px, frame_w):
+    """Centers, distances and angles (0-180 deg, left to right) for an (N,4) box array"""
+    n = boxes.shape[0]
+    cx = np.empty(n, np.int64)
+    cy = np.empty(n, np.int64)
+    distance_m = np.empty(n, np.float64)
+    angle_deg = np.empty(n, np.float64)
+    for k in range(n):
+        cx[k] = (boxes[k, 0] + boxes[k, 2]) // 2
+        cy[k] = (boxes[k, 1] + boxes[k, 3]) // 2
+        distance_m[k] = get_distance_meters(float(boxes[k, 2] - boxes[k, 0]), real_widths[k], focal_px)
+        angle_deg[k] = (cx[k] / frame_w) * 180.0
+    return cx, cy, distance_m, angle_deg
+
+def extract_detections(frame_results, frame):
+    """Turn one frame's YOLO results (one per model) into detection tuples and (cx, cy, angle) stats"""
+    detections = []
+    detection_stats = []
+    for r in frame_results:
+        if len(r.boxes) == 0: continue
+        # One device->host copy per result: rows are [x1, y1, x2, y2, (track_id,) conf, cls]
+        data = r.boxes.data.cpu().numpy()
+        xyxy = data[:, :4]
+        confs = data[:, -2]
+        cls_ids = data[:, -1].astype(int)
+
+        scale = np.array([frame.shape[1], frame.shape[0]] * 2) / INFER_RES
+        boxes = (xyxy.astype(int) * scale).astype(np.int64)
+        w, h = boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]
+        labels = [CLASS_LABELS.get(c, r.names.get(c, f"Class {c}")) for c in cls_ids]
+        real_widths = np.array([REAL_WIDTHS_M.get(l, 0.01) for l in labels], dtype=np.float64)
+        keep = (w >= MIN_BOX_SIZE) & (h >= MIN_BOX_SIZE) & np.isin(labels, list(CLASS_LABELS.values()))
+
+        cxs, cys, distances, angles = compute_detection_stats(boxes, real_widths, FOCAL_LENGTH_PIXELS, float(frame.shape[1]))
+        for j in np.flatnonzero(keep):
+            x1, y1, x2, y2 = boxes[j].tolist()
+            detections.append((x1, y1, x2, y2, labels[j], float(distances[j]), float(confs[j])))
+            detection_stats.append((int(cxs[j]), int(cys[j]), float(angles[j])))
+    return detections, detection_stats
+
+def update_track_velocity(detections, detection_stats, capture_time):
+    """Per-label pixel velocity between consecutive YOLO frames (px/s, from capture times)"""
+    new_centers = {}
+    for (_, _, _, _, label, _, _), (cx, cy, _) in zip(detections, detection_stats):
+        if label in detected_centers:
+            pcx, pcy, pt = detected_centers[label]
+            dt = capture_time - pt
+            track_velocity[label] = ((cx-pcx)/dt, (cy-pcy)/dt) if dt > 0 else (0.0, 0.0)
+        else:
+            track_velocity[label] = (0.0, 0.0)
+        new_centers[label] = (cx, cy, capture_time)
+    detected_centers.clear()
+    detected_centers.update(new_centers)
+
+def predict_detections(detections, detection_stats, elapsed, frame_w):
+    """Constant-velocity prediction of the last YOLO detections, `elapsed` seconds later"""
+    predicted, predicted_stats = [], []
+    for (x1, y1, x2, y2, label, distance_m, conf), (cx, cy, _) in zip(detections, detection_stats):
+        vx, vy = track_velocity.get(label, (0.0, 0.0))
+        dx, dy = int(vx*elapsed), int(vy*elapsed)
+        cx, cy = cx+dx, cy+dy
+        predicted.append((x1+dx, y1+dy, x2+dx, y2+dy, label, distance_m, conf))
+        predicted_stats.append((cx, cy, (cx / frame_w) * 180.0))
+    return predicted, predicted_stats
+
+# Static radar geometry, computed once
+RADAR_CENTER = RADAR_SIZE // 2
+RADAR_MAX_R = RADAR_SIZE // 2 - 20
+RADAR_RING_PX = np.array([int((r_m / RADAR_RANGE_M) * RADAR_MAX_R) for r_m in RADAR_CIRCLES], dtype=np.int32)
+RADAR_SPOKES = np.array([(int(RADAR_CENTER + RADAR_MAX_R * math.cos(math.radians(deg))),
+                          int(RADAR_CENTER - RADAR_MAX_R * math.sin(math.radians(deg))))
+                         for deg in range(0, 360, 45)], dtype=np.int32)
+
+def render_radar_base():
+    """Draw the static radar grid (rings, labels, spokes)"""
+    radar = np.zeros((RADAR_SIZE, RADAR_SIZE, 3), dtype=np.uint8)
+    c = (RADAR_CENTER, RADAR_CENTER)
+    for r_m, r_px in zip(RADAR_CIRCLES, RADAR_RING_PX.tolist()):
+        cv2.circle(radar, c, r_px, (30, 80, 30), 1)
+        cv2.putText(radar, f"{r_m:.1f}m", (RADAR_CENTER+5, RADAR_CENTER-r_px+10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.35, (100,200,100), 1)
-    for deg in range(0, 360, 45):
-        rad = math.radians(deg)
-        x, y = int(cx + max_r * math.cos(rad)), int(cy - max_r * math.sin(rad))
-        cv2.line(radar, (cx, cy), (x, y), (40,40,40), 1)
+    for x, y in RADAR_SPOKES.tolist():
+        cv2.line(radar, c, (x, y), (40,40,40), 1)
+    return radar
+
+RADAR_BG = render_radar_base()
+
+def draw_radar(overlay, *args, radar=None):
+    """Copy the cached grid into `radar` and let `overlay(radar, *args)` draw the dynamic layer"""
+    if radar is None: radar = np.empty_like(RADAR_BG)
+    np.copyto(radar, RADAR_BG)
+    overlay(radar, *args)
+    return radar
+
+def overlay_points(radar, radar_data):
     for norm_x, distance_m, label in radar_data:
         if label not in CLASS_LABELS.values(): continue
-        r_px = int(min(max_r, (distance_m / RADAR_RANGE_M) * max_r))
-        x = int(cx + norm_x * max_r)
-        y = int(cy - r_px)
+        r_px = int(min(RADAR_MAX_R, (distance_m / RADAR_RANGE_M) * RADAR_MAX_R))
+        x = int(RADAR_CENTER + norm_x * RADAR_MAX_R)
+        y = int(RADAR_CENTER - r_px)
         cv2.circle(radar, (x, y), 5, (0,200,0), -1)
         cv2.putText(radar, label[0], (x+6, y), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (0,255,0), 1)
-    return radar
 
-def draw_radar_trajectories(trajectories, radar_size):
-    radar = np.zeros((radar_size, radar_size, 3), dtype=np.uint8)
-    cx, cy = radar_size // 2, radar_size // 2
-    max_r = radar_size // 2 - 20
-    for r_m in RADAR_CIRCLES:
-        r_px = int((r_m / RADAR_RANGE_M) * max_r)
-        cv2.circle(radar, (cx, cy), r_px, (30, 80, 30), 1)
-        cv2.putText(radar, f"{r_m:.1f}m", (cx+5, cy-r_px+10),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.35, (100,200,100), 1)
-    for deg in range(0, 360, 45):
-        rad = math.radians(deg)
-        x, y = int(cx + max_r * math.cos(rad)), int(cy - max_r * math.sin(rad))
-        cv2.line(radar, (cx, cy), (x, y), (40,40,40), 1)
+def overlay_trajectories(radar, trajectories, traj_heads):
     for label, traj in trajectories.items():
         if label not in CLASS_LABELS.values(): continue
-        if len(traj) >= 2:
-            cv2.arrowedLine(radar, tuple(traj[-2]), tuple(traj[-1]),
+        head = traj_heads[label]
+        if head >= 2:
+            p0 = traj[(head-2) % MAX_TRAIL].tolist()
+            p1 = traj[(head-1) % MAX_TRAIL].tolist()
+            cv2.arrowedLine(radar, tuple(p0), tuple(p1),
                             (0,0,255), 2, tipLength=0.3)
-    return radar
 
-def save_species_summary_to_json(species_summary):
+def predict_frames(model, frames):
+    """One result per frame: batched for PyTorch weights, per-frame for exported backends (single-image)"""
+    if isinstance(model.model, torch.nn.Module):
+        return model.predict(frames, imgsz=INFER_RES, conf=CONF_THRESH, verbose=False)
+    return [model.predict(f, imgsz=INFER_RES, conf=CONF_THRESH, verbose=False)[0] for f in frames]
+
+def lores_to_bgr(lores):
+    """Planar YUV420 lores array -> BGR image at INFER_RES (same channel order as the main stream)"""
+    return cv2.cvtColor(lores, cv2.COLOR_YUV420p2BGR)
+
+def capture_loop():
+    """Grab camera frames on a separate thread so capture overlaps inference"""
+    while capture_running.is_set():
+        (frame, lores), metadata = picam2.capture_arrays(["main", "lores"])
+        if frame is None or lores is None: continue
+        small_frame = lores_to_bgr(lores)
+        # Capture time (seconds, monotonic): frames are processed in bursts after inference,
+        # so timing must come from the sensor, not from when the main loop gets to the frame
+        sensor_ts = metadata.get("SensorTimestamp")
+        capture_time = sensor_ts / 1e9 if sensor_ts else time.monotonic()
+        # Keep the newest frames: when the main loop is busy, drop the oldest queued frame
+        try:
+            frame_queue.put_nowait((frame, small_frame, capture_time))
+        except queue.Full:
+            try:
+                frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+            frame_queue.put_nowait((frame, small_frame, capture_time))
+
+def save_species_summary_to_json():
     """Save snapshot of current species summary"""
     timestamp = datetime.now().isoformat()
-    json_data[timestamp] = {}
-    for label, info in species_summary.items():
-        json_data[timestamp][label] = {
-            "start_distance_m": round(info.get("entry_distance_m",0), 2),
-            "end_distance_m": round(info.get("exit_distance_m",0), 2),
-            "start_angle_deg": round(info.get("entry_angle_deg",0), 1),
-            "end_angle_deg": round(info.get("exit_angle_deg",0), 1),
-            "count": info.get("count",0)
+    snapshot = {}
+    for sid in np.flatnonzero(species_seen):
+        snapshot[SPECIES[sid]] = {
+            "start_distance_m": round(float(species_entry_dist[sid]), 2),
+            "end_distance_m": round(float(species_exit_dist[sid]), 2),
+            "start_angle_deg": round(float(species_entry_angle[sid]), 1),
+            "end_angle_deg": round(float(species_exit_angle[sid]), 1),
+            "count": int(species_count[sid])
         }
-    save_json()
+    json_queue.put((timestamp, snapshot))
 
 
 # ==========================
 # MAIN LOOP
 # ==========================
+capture_thread = threading.Thread(target=capture_loop, daemon=True)
+capture_thread.start()
+json_writer = threading.Thread(target=json_writer_loop, daemon=True)
+json_writer.start()
+
 try:
-    while True:
-        frame = picam2.capture_array()
-        if frame is None: continue
-        small_frame = cv2.resize(frame, (INFER_RES, INFER_RES))
-        detections = []
-
-        # YOLO predictions
-        for model in models:
-            results = model.predict(small_frame, imgsz=INFER_RES, conf=CONF_THRESH, verbose=False)
-            for r in results:
-                for box in r.boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0].cpu().numpy())
-                    scale_x = frame.shape[1] / INFER_RES
-                    scale_y = frame.shape[0] / INFER_RES
-                    x1, x2 = int(x1*scale_x), int(x2*scale_x)
-                    y1, y2 = int(y1*scale_y), int(y2*scale_y)
-                    w, h = x2-x1, y2-y1
-                    if w<MIN_BOX_SIZE or h<MIN_BOX_SIZE: continue
-
-                    cls_id = int(box.cls[0])
-                    conf = float(box.conf[0].cpu())
-                    label = CLASS_LABELS.get(cls_id, r.names.get(cls_id, f"Class {cls_id}"))
-                    if label not in CLASS_LABELS.values(): continue
-
-                    real_w_m = REAL_WIDTHS_M.get(label, 0.01)
-                    width_px = float(w)
-                    distance_m = get_distance_meters(width_px, real_w_m, FOCAL_LENGTH_PIXELS)
-
-                    detections.append((x1, y1, x2, y2, label, distance_m, conf))
-
-        radar_points = []
-        current_labels = set()
-        now = time.time()
-
-        for (x1, y1, x2, y2, label, distance_m, conf) in detections:
-            current_labels.add(label)
-            cx, cy = (x1+x2)//2, (y1+y2)//2
-
-            # Angle 0-180 degrees (left to right)
-            angle_deg = ((cx / frame.shape[1]) * 180.0)
-
-            # Speed calculation
-            if label in speed_tracker:
-                px, py, pt, prev_speed = speed_tracker[label]
-                dt = now - pt
-                if dt>0:
-                    dist_px = np.sqrt((cx-px)**2 + (cy-py)**2)
-                    speed_mps = (dist_px*0.02)/dt
-                    speed_tracker[label]=(cx,cy,now,speed_mps)
+    running = True
+    last_detections, last_stats, last_detect_time = [], [], 0.0
+    while running:
+        batch = [frame_queue.get() for _ in range(BATCH * DETECT_EVERY)]
+        small_frames = [small for _, small, _ in batch[::DETECT_EVERY]]
+
+        # YOLO predictions: one forward pass per model over every DETECT_EVERY-th frame
+        batch_results = [predict_frames(model, small_frames) for model in models]
+
+        for i, (frame, _, capture_time) in enumerate(batch):
+            if i % DETECT_EVERY == 0:
+                detections, detection_stats = extract_detections([results[i // DETECT_EVERY] for results in batch_results], frame)
+                update_track_velocity(detections, detection_stats, capture_time)
+                last_detections, last_stats, last_detect_time = detections, detection_stats, capture_time
             else:
-                speed_tracker[label]=(cx,cy,now,0.0)
-            speed_mps = speed_tracker[label][3]
-
-            # Species summary update
-            if label not in species_summary:
-                species_summary[label] = {
-                    "count": 0,
-                    "entry_angle_deg": round(angle_deg, 1),
-                    "exit_angle_deg": round(angle_deg, 1),
-                    "entry_distance_m": round(distance_m, 2),
-                    "exit_distance_m": round(distance_m, 2)
-                }
-            species_summary[label]["count"] += 1
-            species_summary[label]["exit_angle_deg"] = round(angle_deg, 1)
-            species_summary[label]["exit_distance_m"] = round(distance_m, 2)
-
-            # Nearest encounter
-            if distance_m < nearest_encounter["distance_m"]:
-                nearest_encounter.update({
-                    "distance_m": round(distance_m,3),
-                    "frame": frame_id,
-                    "label": label,
-                    "angle_deg": round(angle_deg,1)
-                })
-
-            # Draw boxes and arrows
-            cv2.rectangle(frame,(x1,y1),(x2,y2),(0,255,0),2)
-            cv2.putText(frame,f"{label} {distance_m:.2f}m {speed_mps:.2f}m/s",(x1,max(y1-5,15)),
-                        cv2.FONT_HERSHEY_SIMPLEX,0.7,(0,255,0),2)
-            if label in prev_centers:
-                prev_cx, prev_cy = prev_centers[label]
-                dx, dy = cx-prev_cx, cy-prev_cy
-                length = int(np.sqrt(dx**2+dy**2))
-                if length>0:
-                    scale=40
-                    dir_x=int((dx/length)*scale)
-                    dir_y=int((dy/length)*scale)
-                    cv2.arrowedLine(frame,(cx,cy),(cx+dir_x,cy+dir_y),(0,0,255),2,tipLength=0.4)
-            prev_centers[label]=(cx,cy)
-
-            norm_x = (cx/frame.shape[1])-0.5
-            radar_points.append((norm_x,distance_m,label))
-            if label not in trajectories: trajectories[label]=deque(maxlen=MAX_TRAIL)
-            r_px=int(min((distance_m/RADAR_RANGE_M)*(RADAR_SIZE//2-20), RADAR_SIZE//2-20))
-            x=int(RADAR_SIZE//2 + norm_x*(RADAR_SIZE//2-20))
-            y=int(RADAR_SIZE//2 - r_px)
-            trajectories[label].append((x,y))
-
-        # Remove missing insects
-        for lbl in list(trajectories.keys()):
-            if lbl not in current_labels:
-                trajectories.pop(lbl,None)
-                prev_centers.pop(lbl,None)
-                speed_tracker.pop(lbl,None)
-
-        # OLED/LED display
-        try:
-            oledandled.reset_leds()
-            if detections:
-                _,_,_,_,first_label,_,_=detections[0]
-                cls_name=first_label.lower()
-                if 'fly' in cls_name: oledandled.lgpio.gpio_write(oledandled.chip, oledandled.GREEN_LED,1)
-                elif 'cockroach' in cls_name: oledandled.lgpio.gpio_write(oledandled.chip, oledandled.YELLOW_LED,1)
-
-            total_insects=len(detections)
-            nearest_track=min(detections,key=lambda d:d[5]) if detections else None
-            if nearest_track:
-                x1,y1,x2,y2,nearest_label,nearest_distance, _=nearest_track
-                nearest_speed_mps=0.0
-                if nearest_label in speed_tracker: nearest_speed_mps=speed_tracker[nearest_label][3]
-                oled_lines=[
-                    f"Insects: {total_insects}",
-                    f"Nearest: {nearest_label}",
-                    f"Distance: {nearest_distance:.2f}m",
-                    f"Speed: {nearest_speed_mps:.2f} m/s"
-                ]
-                oledandled.display_on_oled(oled_lines)
-        except Exception as e:
-            print("OLED/LED error:", e)
-
-        # Radar drawing
-        radar1=draw_radar_points(radar_points,RADAR_SIZE)
-        radar2=draw_radar_trajectories(trajectories,RADAR_SIZE)
-        radar_combined=np.hstack([radar1,radar2])
-        disp=cv2.resize(frame,LOW_RES)
-        radar_rs=cv2.resize(radar_combined,(LOW_RES[0],RADAR_SIZE))
-        final_display=np.vstack([disp,radar_rs])
-
-        out.write(final_display)
-        cv2.imshow("Insect Detection + Dual Radar",final_display)
-
-        frame_id+=1
-        # Save JSON every 30 frames (~1 sec)
-        if frame_id % 30 == 0:
-            save_species_summary_to_json(species_summary)
-
-        curr_time = time.time()
-        fps = 1/(curr_time-prev_time) if prev_time else 0
-        prev_time = curr_time
-        print(f"FPS: {fps:.1f}", end="\r")
-
-        if cv2.waitKey(1) & 0xFF == ord("q"): break
+                detections, detection_stats = predict_detections(last_detections, last_stats,
+                                                                 capture_time - last_detect_time, frame.shape[1])
+
+            radar_points = []
+            current_labels = set()
+            now = capture_time
+
+            for (x1, y1, x2, y2, label, distance_m, conf), (cx, cy, angle_deg) in zip(detections, detection_stats):
+                current_labels.add(label)
+
+                # Speed calculation
+                if label in speed_tracker:
+                    px, py, pt, prev_speed = speed_tracker[label]
+                    dt = now - pt
+                    if dt>0:
+                        dist_px = math.hypot(cx-px, cy-py)
+                        speed_mps = (dist_px*0.02)/dt
+                        speed_tracker[label]=(cx,cy,now,speed_mps)
+                else:
+                    speed_tracker[label]=(cx,cy,now,0.0)
+                speed_mps = speed_tracker[label][3]
+
+                # Species summary update
+                sid = SPECIES_INDEX[label]
+                if not species_seen[sid]:
+                    species_seen[sid] = True
+                    species_entry_angle[sid] = angle_deg
+                    species_entry_dist[sid] = distance_m
+                species_count[sid] += 1
+                species_exit_angle[sid] = angle_deg
+                species_exit_dist[sid] = distance_m
+
+                # Nearest encounter
+                if nearest_encounter["distance_m"] is None or distance_m < nearest_encounter["distance_m"]:
+                    nearest_encounter.update({
+                        "distance_m": round(distance_m,3),
+                        "frame": frame_id,
+                        "label": label,
+                        "angle_deg": round(angle_deg,1)
+                    })
+
+                # Draw boxes and arrows
+                cv2.rectangle(frame,(x1,y1),(x2,y2),(0,255,0),2)
+                cv2.putText(frame,f"{label} {distance_m:.2f}m {speed_mps:.2f}m/s",(x1,max(y1-5,15)),
+                            cv2.FONT_HERSHEY_SIMPLEX,0.7,(0,255,0),2)
+                if label in prev_centers:
+                    prev_cx, prev_cy = prev_centers[label]
+                    dx, dy = cx-prev_cx, cy-prev_cy
+                    length = int(math.hypot(dx, dy))
+                    if length>0:
+                        scale=40
+                        dir_x=int((dx/length)*scale)
+                        dir_y=int((dy/length)*scale)
+                        cv2.arrowedLine(frame,(cx,cy),(cx+dir_x,cy+dir_y),(0,0,255),2,tipLength=0.4)
+                prev_centers[label]=(cx,cy)
+
+                norm_x = (cx/frame.shape[1])-0.5
+                radar_points.append((norm_x,distance_m,label))
+                if label not in trajectories:
+                    trajectories[label]=np.zeros((MAX_TRAIL,2),dtype=np.int32)
+                    traj_heads[label]=0
+                r_px=int(min((distance_m/RADAR_RANGE_M)*RADAR_MAX_R, RADAR_MAX_R))
+                x=int(RADAR_CENTER + norm_x*RADAR_MAX_R)
+                y=int(RADAR_CENTER - r_px)
+                trajectories[label][traj_heads[label] % MAX_TRAIL]=(x,y)
+                traj_heads[label]+=1
+
+            # Remove missing insects
+            for lbl in list(trajectories.keys()):
+                if lbl not in current_labels:
+                    trajectories.pop(lbl,None)
+                    traj_heads.pop(lbl,None)
+                    prev_centers.pop(lbl,None)
+                    speed_tracker.pop(lbl,None)
+
+            # OLED/LED display
+            try:
+                oledandled.reset_leds()
+                if detections:
+                    _,_,_,_,first_label,_,_=detections[0]
+                    cls_name=first_label.lower()
+                    if 'fly' in cls_name: oledandled.lgpio.gpio_write(oledandled.chip, oledandled.GREEN_LED,1)
+                    elif 'cockroach' in cls_name: oledandled.lgpio.gpio_write(oledandled.chip, oledandled.YELLOW_LED,1)
+
+                total_insects=len(detections)
+                nearest_track=min(detections,key=lambda d:d[5]) if detections else None
+                if nearest_track:
+                    x1,y1,x2,y2,nearest_label,nearest_distance, _=nearest_track
+                    nearest_speed_mps=0.0
+                    if nearest_label in speed_tracker: nearest_speed_mps=speed_tracker[nearest_label][3]
+                    oled_lines=[
+                        f"Insects: {total_insects}",
+                        f"Nearest: {nearest_label}",
+                        f"Distance: {nearest_distance:.2f}m",
+                        f"Speed: {nearest_speed_mps:.2f} m/s"
+                    ]
+                    oledandled.display_on_oled(oled_lines)
+            except Exception as e:
+                print("OLED/LED error:", e)
+
+            # Radar drawing
+            draw_radar(overlay_points,radar_points,radar=radar1)
+            draw_radar(overlay_trajectories,trajectories,traj_heads,radar=radar2)
+            np.concatenate([radar1,radar2],axis=1,out=radar_combined)
+            cv2.resize(frame,LOW_RES,dst=final_display[:LOW_RES[1]])
+            cv2.resize(radar_combined,(LOW_RES[0],RADAR_SIZE),dst=final_display[LOW_RES[1]:])
+
+            out.write(final_display)
+            cv2.imshow("Insect Detection + Dual Radar",final_display)
+
+            frame_id+=1
+            # Save JSON every 30 frames (~1 sec)
+            if frame_id % 30 == 0:
+                save_species_summary_to_json()
+
+            curr_time = time.time()
+            fps = 1/(curr_time-prev_time) if prev_time else 0
+            prev_time = curr_time
+            print(f"FPS: {fps:.1f}", end="\r")
+
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                running = False
+                break
 
 finally:
     # Save final summary
-    save_species_summary_to_json(species_summary)
-    json_data["nearest_encounter"] = nearest_encounter
-    save_json()
+    save_species_summary_to_json()
+    json_queue.put(("nearest_encounter", dict(nearest_encounter)))
+    json_queue.put(None)
+    json_writer.join()
+    capture_running.clear()
+    capture_thread.join(timeout=1.0)
     cv2.destroyAllWindows()
     picam2.stop()
     out.release()
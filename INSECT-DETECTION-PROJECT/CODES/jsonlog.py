@@ -0,0 +1,23 @@
+import json
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    print("⚠️ orjson not found, using stdlib json.")
+    ORJSON_AVAILABLE = False
+
+def parse_json(raw: bytes):
+    """orjson when available; stdlib json for logs it rejects (e.g. older `Infinity` values)"""
+    if ORJSON_AVAILABLE:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+def dump_json(data) -> bytes:
+    """2-space indent with either library (orjson's only indent); never writes NaN/Infinity"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, indent=2, allow_nan=False).encode()